@@ -1,11 +1,15 @@
+import os
 import serial
 import numpy as np
 import time
+import logging
 from datetime import datetime
 
+from gauge275 import Gauge275    # next to this script or on PYTHONPATH, see README.md
+
 # Configurations about the Arduino output
-serial_port = 'COM7'    # The port that data comes out
-baud_rate = 9600        # sampling rate
+serial_port = os.environ.get('ARDUINO_PORT', 'COM7')       # The port that data comes out
+baud_rate = int(os.environ.get('ARDUINO_BAUD', '9600'))    # sampling rate
 
 # Connect to the Arduino
 try:
@@ -21,40 +25,8 @@ except:
 ####      Data from roughing gauge      ####
 ############################################
 
-'''Returned pressure is a string, not a float point number'''
-def readout_275gauge(address = '01'):
-
-    serial_port = 'COM6'
-    baud_rate = 19200
-
-    # connect to the pressure gauge
-    try:
-        ser = serial.Serial(
-                serial_port,
-                baud_rate,
-                timeout = 0.5,
-                bytesize = serial.EIGHTBITS,
-                stopbits = serial.STOPBITS_ONE,
-                parity = serial.PARITY_NONE,
-                dsrdtr = True
-                )
-    except:
-        try:
-            ser.close()
-        except:
-            print("Serial port already closed!")
-        ser = serial.Serial(serial_port, baud_rate)
-    ser.flushInput()
-
-    # readout pressure
-    cmd = '#' + address + 'RD \x0D'
-    ser.write(cmd.encode('utf-8'))
-    recv = ser.read(13)
-    pressure = recv.decode()[4:12]
-
-    ser.close()
-
-    return pressure
+# Port and baud rate come from GAUGE_PORT / GAUGE_BAUD, see gauge275.py
+gauge = Gauge275()
 
 ##########################################################
 ####      Receive measured data from serial port      ####
@@ -62,19 +34,19 @@ def readout_275gauge(address = '01'):
 
 ''' Handling Type 1 error: Sometimes the message carries some mysterious 
 '\xff' etc things, which would make decode() to generate some error, so 
-we use the procedure below to avoid such error.'''
-def read_series(cycle=7):
+we use the procedure below to avoid such error. Only the first failed read
+is reported, and RuntimeError is raised if all `max_retries` reads fail.'''
+def read_series(cycle=7, max_retries=16):
 
-    while True:
+    for attempt in range(max_retries):
         hlp = ser.read(4*cycle)
         try:
-            hlp = hlp.decode()
-            break
-        except:
-            print('Type 1 error occured!')
-            continue
+            return hlp.decode()
+        except UnicodeDecodeError:
+            if attempt == 0:
+                logging.warning('Type 1 error occured!')
 
-    return hlp
+    raise RuntimeError('Persistent decode failure after %d reads, check baud rate and cable' % max_retries)
 
 #########################################
 ####      Extract data from hlp      ####
@@ -83,24 +55,39 @@ def read_series(cycle=7):
 # Voltage of room temperature chamber begins with 4
 # Voltage of cryo dewar begins with 5
 
+# Type 2 errors not reported yet, and time of the last Type 2 warning
+_dropped = 0
+_last_warning = None
+
+'''Report Type 2 errors at most once every `interval` seconds, so a
+garbled message (e.g. bad cable) does not flood the console.'''
+def warn_type2(interval=10):
+
+    global _dropped, _last_warning
+
+    _dropped += 1
+    now = time.monotonic()
+    if _last_warning is None or now - _last_warning >= interval:
+        logging.warning('Type 2 error occured! (%d messages dropped)', _dropped)
+        _dropped = 0
+        _last_warning = now
+
 '''Handling Type 2 error: Sometimes some bytes of the message shifts
 and destroys the recorded values, in the procedure below, we request
 the message again when this error occurs.'''
 def get_voltages():
 
-    converted = False
-    while not converted:
+    while True:
         hlp = read_series()
-        for i, char in enumerate(hlp):
-            if (char == '\n') and (hlp[i+1] == '4'):
-                try:
-                    voltage_room = float(hlp[i+2:i+6])
-                    voltage_cryo = float(hlp[i+9:i+13])
-                    converted = True
-                    break
-                except:
-                    print('Type 2 error occured!')
-                    break
+        idx = hlp.find('\n4')
+        if idx < 0 or idx + 13 > len(hlp):
+            continue
+        try:
+            voltage_room = float(hlp[idx+2:idx+6])
+            voltage_cryo = float(hlp[idx+9:idx+13])
+            break
+        except ValueError:
+            warn_type2()
 
     return voltage_room, voltage_cryo
 
@@ -113,7 +100,7 @@ that some value shifts to another value. To prevent this, we request multiple
 values each time for error correction.'''
 def correct(vols, TOL=0.1):
 
-    ptp = vols.ptp()
+    ptp = vols.max() - vols.min()    # ndarray.ptp() is gone in NumPy 2
     if ptp > TOL:
         print('Type 3 error occured!')
         good_datas = abs(vols - np.median(vols)) < TOL
@@ -182,13 +169,24 @@ def get_log_text():
 
     # Read pressure and create log text
     pressure_room, pressure_cryo = get_pressure()
-    pressure_rough = readout_275gauge()
+    pressure_rough = gauge.read()
     str_room = date_time + ',' + str(pressure_room) + '\n'
     str_cryo = date_time + ',' + str(pressure_cryo) + '\n'
     str_rough = date_time + ',' + pressure_rough + '\n'
 
     return str_room, str_cryo, str_rough
 
+'''Close and reopen the Arduino port, used when read_series() keeps failing.
+If the port cannot be opened, the next read fails and this is tried again.'''
+def reopen_arduino():
+
+    ser.close()
+    time.sleep(1)
+    try:
+        ser.open()
+    except serial.SerialException:
+        logging.exception('Reopening the Arduino port failed')
+
 ########################
 ####      Main      ####
 ########################
@@ -198,6 +196,9 @@ path_rough = 'Z:\\Logs\\1041_Dewar_Foreline\\'
 path_room = 'Z:\\Logs\\1041_Chamber_Pressure\\'
 path_cryo = 'Z:\\Logs\\1041_Dewar_Pressure\\'
 
+max_failures = 5    # consecutive failures before the serial ports are reopened
+failures = 0
+
 now = datetime.now()
 current_date = now.strftime('%Y-%m-%d')
 
@@ -211,7 +212,25 @@ while True:
             date = now.strftime('%Y-%m-%d')
 
             if date == current_date:
-                str_room, str_cryo, str_rough = get_log_text()
+                try:
+                    str_room, str_cryo, str_rough = get_log_text()
+                except RuntimeError:
+                    logging.exception('Reading the Arduino failed, reopening the port')
+                    reopen_arduino()
+                    continue
+                except (serial.SerialException, ValueError):
+                    logging.exception('Reading the gauges failed, retrying')
+                    failures += 1
+                    # A dead handle may still report is_open, so reopen both
+                    # ports after repeated failures as well
+                    if not ser.is_open or failures > max_failures:
+                        gauge.close()
+                        reopen_arduino()
+                        failures = 0
+                    else:
+                        time.sleep(1)
+                    continue
+                failures = 0
                 file_room.write(str_room)
                 file_cryo.write(str_cryo)
                 file_rough.write(str_rough)
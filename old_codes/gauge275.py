@@ -0,0 +1,76 @@
+import os
+import functools
+import serial
+
+# Configurations about the 275 gauge, can be overridden by environment variables
+GAUGE_PORT = os.environ.get('GAUGE_PORT', 'COM6')
+GAUGE_BAUD = int(os.environ.get('GAUGE_BAUD', '19200'))
+
+'''Readout command for the gauge at `address`, encoded once per address.'''
+@functools.lru_cache(maxsize=8)
+def _cmd(address):
+
+    return ('#' + address + 'RD \x0D').encode('ascii')
+
+############################################
+####      Data from roughing gauge      ####
+############################################
+
+'''Reader for the 275 (Convectron) roughing gauge. The port is opened on the
+first read and kept open between reads; if it fails, it is closed and
+reopened on the next read.'''
+class Gauge275:
+
+    def __init__(self, port = GAUGE_PORT, baud = GAUGE_BAUD):
+
+        self.port = port
+        self.baud = baud
+        self.ser = None
+
+    def connect(self):
+
+        # connect to the pressure gauge
+        self.close()
+        self.ser = serial.Serial(
+                self.port,
+                self.baud,
+                timeout = 0.5,
+                bytesize = serial.EIGHTBITS,
+                stopbits = serial.STOPBITS_ONE,
+                parity = serial.PARITY_NONE,
+                dsrdtr = True
+                )
+
+    def close(self):
+
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+    '''Returned pressure is a string, not a float point number.
+
+    The response starts with '*' and the address. If stale bytes come before
+    it, the response is taken from that prefix on; a response without the
+    prefix raises ValueError.'''
+    def read(self, address = '01'):
+
+        if self.ser is None:
+            self.connect()
+
+        # readout pressure
+        prefix = b'*' + address.encode('ascii')
+        try:
+            self.ser.reset_input_buffer()
+            self.ser.write(_cmd(address))
+            recv = self.ser.read(13)
+            idx = recv.find(prefix)
+            if idx < 0:
+                raise ValueError('Unexpected response from the 275 gauge: %r' % recv)
+            if idx > 0:
+                recv = recv[idx:] + self.ser.read(idx)
+        except serial.SerialException:
+            self.close()
+            raise
+        pressure = recv.decode()[4:12]
+
+        return pressure
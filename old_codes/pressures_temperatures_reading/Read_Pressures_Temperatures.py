@@ -1,110 +1,161 @@
+import os
+import sys
 import serial
 import numpy as np
 import time
+import math
+import queue
+import tempfile
+import logging
+import logging.handlers
+import threading
 from datetime import datetime
 
+# gauge275.py is shared with the other scripts in old_codes (see README.md)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gauge275 import Gauge275
+
 # Configurations about the Arduino output
-serial_port = 'COM7'    # The port that data comes out
-baud_rate = 9600        # sampling rate
+# Set ARDUINO_BAUD=115200 once the sketch runs with Serial.begin(115200)
+serial_port = os.environ.get('ARDUINO_PORT', 'COM7')       # The port that data comes out
+baud_rate = int(os.environ.get('ARDUINO_BAUD', '9600'))    # sampling rate, must match the Arduino sketch
+timeout = 0.05          # short timeout, so that line reads do not stall
 
 # Connect to the Arduino
 try:
-    ser = serial.Serial(serial_port, baud_rate)
-except:
+    ser = serial.Serial(serial_port, baud_rate, timeout = timeout)
+except serial.SerialException:
     try:
         ser.close()
-    except:
+    except NameError:
         print ("Serial port already closed" )
-    ser = serial.Serial(serial_port, baud_rate)
+    ser = serial.Serial(serial_port, baud_rate, timeout = timeout)
 
 ############################################
 ####      Data from roughing gauge      ####
 ############################################
 
-'''Returned pressure is a string, not a float point number'''
-def readout_275gauge(address = '01'):
+# Port and baud rate come from GAUGE_PORT / GAUGE_BAUD, see gauge275.py
+gauge = Gauge275()
 
-    serial_port = 'COM6'
-    baud_rate = 19200
+##########################################################
+####      Receive measured data from serial port      ####
+##########################################################
 
-    # connect to the pressure gauge
-    try:
-        ser = serial.Serial(
-                serial_port,
-                baud_rate,
-                timeout = 0.5,
-                bytesize = serial.EIGHTBITS,
-                stopbits = serial.STOPBITS_ONE,
-                parity = serial.PARITY_NONE,
-                dsrdtr = True
-                )
-    except:
-        try:
-            ser.close()
-        except:
-            print("Serial port already closed!")
-        ser = serial.Serial(serial_port, baud_rate)
-    ser.flushInput()
+# Every value comes on its own line, e.g. '40.88\r\n'
+# Voltage of room temperature chamber begins with 4
+# Voltage of cryo dewar begins with 5
+# The ICR and ICH voltages follow on the next two lines
 
-    # readout pressure
-    cmd = '#' + address + 'RD \x0D'
-    ser.write(cmd.encode('utf-8'))
-    recv = ser.read(13)
-    pressure = recv.decode()[4:12]
+'''Background thread which keeps draining the Arduino port, so that no data
+is lost while the main loop is busy or sleeping. Parsed samples are pushed
+to the queue `q` as (v_room, v_cryo, v_ICR, v_ICH); when the queue is full
+the oldest sample is dropped, so `q` always holds the most recent ones.
 
-    ser.close()
+Handling Type 1 error: Sometimes the message carries some mysterious 
+'\xff' etc things. We keep the message as raw bytes so that such bytes never
+go through decode(); a corrupted field simply fails float() and is handled
+as a Type 2 error.
 
-    return pressure
+Handling Type 2 error: Sometimes some bytes of the message shifts and
+destroys the recorded values. Such a frame is dropped and the next one is
+used instead.'''
+class SerialReader(threading.Thread):
 
-##########################################################
-####      Receive measured data from serial port      ####
-##########################################################
+    def __init__(self, ser, maxsize=16):
 
-''' Handling Type 1 error: Sometimes the message carries some mysterious 
-'\xff' etc things, which would make decode() to generate some error, so 
-we use the procedure below to avoid such error.'''
-def read_series(cycle=7):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.q = queue.Queue(maxsize=maxsize)
+        self._rx = bytearray()
+        self._frame = []
+        self._reopen = threading.Event()
+        self._dropped = 0           # Type 2 errors not reported yet
+        self._last_warning = None   # time of the last Type 2 warning
 
-    while True:
-        hlp = ser.read(8*cycle)
-        try:
-            hlp = hlp.decode()
-            break
-        except:
-            print('Type 1 error occured!')
-            continue
+    '''Ask the thread to close and reopen the Arduino port.'''
+    def reopen(self):
+
+        self._reopen.set()
+
+    '''Return the next complete line, or None if the read timed out first.
+    A partial line is kept in _rx until the rest of it arrives.'''
+    def read_series(self):
+
+        self._rx.extend(self.ser.readline())
+        if not self._rx.endswith(b'\n'):
+            return None
+        line = bytes(self._rx)
+        self._rx.clear()
+
+        return line
 
-    return hlp
+    def _push(self, voltages):
+
+        while True:
+            try:
+                self.q.put_nowait(voltages)
+                return
+            except queue.Full:
+                try:
+                    self.q.get_nowait()
+                except queue.Empty:
+                    pass
+
+    '''Report Type 2 errors at most once every `interval` seconds, so a
+    garbled line (e.g. wrong baud rate) does not flood the console.'''
+    def _warn_type2(self, interval=10):
+
+        self._dropped += 1
+        now = time.monotonic()
+        if self._last_warning is None or now - self._last_warning >= interval:
+            logging.warning('Type 2 error occured! (%d frames dropped)', self._dropped)
+            self._dropped = 0
+            self._last_warning = now
+
+    def run(self):
+
+        while True:
+            try:
+                if self._reopen.is_set():
+                    self._reopen.clear()
+                    self._rx.clear()
+                    self._frame = []
+                    self.ser.close()
+                    self.ser.open()
+                line = self.read_series()
+            except serial.SerialException:
+                logging.exception('Arduino read failed, reopening the port')
+                self._reopen.set()
+                time.sleep(1)
+                continue
+            if line is None:
+                continue
+
+            # A frame starts with the room temperature chamber line
+            if line[:1] == b'4':
+                self._frame = [line]
+            elif self._frame:
+                self._frame.append(line)
+            if len(self._frame) < 4:
+                continue
+
+            try:
+                voltages = tuple(float(hlp[1:5]) for hlp in self._frame)
+                self._push(voltages)
+            except ValueError:
+                self._warn_type2()
+            self._frame = []
 
 #########################################
 ####      Extract data from hlp      ####
 #########################################
 
-# Voltage of room temperature chamber begins with 4
-# Voltage of cryo dewar begins with 5
+'''Wait for the next sample parsed by the background reader. Raises
+queue.Empty if no sample arrives within `timeout` seconds.'''
+def get_voltages(timeout=5):
 
-'''Handling Type 2 error: Sometimes some bytes of the message shifts
-and destroys the recorded values, in the procedure below, we request
-the message again when this error occurs.'''
-def get_voltages():
-
-    converted = False
-    while not converted:
-        hlp = read_series()
-        for i, char in enumerate(hlp):
-            try:
-                if (char == '\n') and (hlp[i+1] == '4'):
-                    voltage_room = float(hlp[i+2:i+6])
-                    voltage_cryo = float(hlp[i+9:i+13])
-                    voltage_ICR = float(hlp[i+16:i+20])
-                    voltage_ICH = float(hlp[i+23:i+27])
-                    converted = True
-                    break
-            except:
-                print('Type 2 error occured!')
-                break
-
-    return voltage_room, voltage_cryo, voltage_ICR, voltage_ICH
+    return reader.q.get(timeout=timeout)
 
 ####################################################################
 ####      Correct errors and convert voltages to pressures      ####
@@ -115,16 +166,20 @@ that some value shifts to another value. To prevent this, we request multiple
 values each time for error correction.'''
 def correct(vols, TOL=0.1):
 
-    ptp = vols.ptp()
-    if ptp > TOL:
-        print('Type 3 error occured!')
-        good_datas = abs(vols - np.median(vols)) < TOL
-        voltage = vols[good_datas].mean()
-    else:
-        voltage = vols.mean()
+    # vols has one row per channel and one column per repeated sample
+    bad = vols.max(axis=1) - vols.min(axis=1) > TOL
+    if not bad.any():
+        return vols.mean(axis=1)    # all channels within tolerance, no median needed
+
+    logging.warning('Type 3 error occured!')
+    good_datas = np.abs(vols - np.median(vols, axis=1, keepdims=True)) < TOL
+    corrected = (vols * good_datas).sum(axis=1) / good_datas.sum(axis=1)
+    voltage = np.where(bad, corrected, vols.mean(axis=1))
 
     return voltage
 
+# Returns NaN for a resistance outside the valid range (e.g. a saturated
+# or disconnected thermistor channel), so the other channels keep logging
 def T(R):
 
     A = 3.354016E-03
@@ -133,41 +188,55 @@ def T(R):
     D = 1.034240E-07
     R25 = 1E+05
 
-    hlp = np.log(R/R25)
-    TK = 1 / (A + B * hlp + C * hlp ** 2 + D * hlp ** 3)
-    TC = TK - 273.15
+    if not (0 < R < math.inf):
+        return float('nan')
+
+    hlp = math.log(R/R25)
+    inv_TK = A + hlp * (B + hlp * (C + hlp * D))    # Horner form of A + B*x + C*x^2 + D*x^3
+    if inv_TK <= 0:
+        return float('nan')
+    TC = 1 / inv_TK - 273.15
 
     return TC
 
+# The voltages are scalars here, so plain floats and the math module are
+# used instead of NumPy
 def convert(v_room, v_cryo, v_ICR, v_ICH):
 
     R0_ICR = 1E+05
     R0_ICH = 1E+05
     V_s = 3.3
 
-    p_room = 10 ** (v_room * 3 - 10)
-    p_cryo = 10 ** (v_cryo * 3 - 10)
+    v_room = float(v_room)
+    v_cryo = float(v_cryo)
+    v_ICR = float(v_ICR)
+    v_ICH = float(v_ICH)
+
+    p_room = 10.0 ** (v_room * 3 - 10)
+    p_cryo = 10.0 ** (v_cryo * 3 - 10)
 
-    R_ICR = v_ICR / (V_s - v_ICR) * R0_ICR
-    R_ICH = v_ICH / (V_s - v_ICH) * R0_ICH
+    # At or above the supply voltage the divider gives no finite resistance
+    R_ICR = v_ICR / (V_s - v_ICR) * R0_ICR if v_ICR < V_s else float('nan')
+    R_ICH = v_ICH / (V_s - v_ICH) * R0_ICH if v_ICH < V_s else float('nan')
     T_ICR = T(R_ICR)
     T_ICH = T(R_ICH)
 
     return p_room, p_cryo, T_ICR, T_ICH
 
+# Sample buffers of get_pressure_temperature, reused between calls and
+# keyed by the number of repeats
+_vols = {}
+
 def get_pressure_temperature(repeat=5, TOL=0.1):
 
-    vols_room = np.zeros(repeat)
-    vols_cryo = np.zeros(repeat)
-    vols_ICR = np.zeros(repeat)
-    vols_ICH = np.zeros(repeat)
+    # Rows: room, cryo, ICR, ICH
+    vols = _vols.get(repeat)
+    if vols is None:
+        vols = _vols[repeat] = np.empty((4, repeat))
     for i in range(repeat):
-        vols_room[i], vols_cryo[i], vols_ICR[i], vols_ICH[i] = get_voltages()
+        vols[:, i] = get_voltages()
 
-    voltage_room = correct(vols_room, TOL)
-    voltage_cryo = correct(vols_cryo, TOL)
-    voltage_ICR = correct(vols_ICR, TOL)
-    voltage_ICH = correct(vols_ICH, TOL)
+    voltage_room, voltage_cryo, voltage_ICR, voltage_ICH = correct(vols, TOL)
 
     pressure_room, pressure_cryo, temperature_ICR, temperature_ICH = convert(voltage_room, voltage_cryo, voltage_ICR, voltage_ICH)
 
@@ -217,14 +286,106 @@ def get_log_text():
 
     # Read pressure and create log text
     pressure_room, pressure_cryo, temperature_ICR, temperature_ICH = get_pressure_temperature()
-    pressure_rough = readout_275gauge()
-    str_room = date_time + ',' + str(pressure_room) + '\n'
-    str_cryo = date_time + ',' + str(pressure_cryo) + '\n'
-    str_rough = date_time + ',' + pressure_rough + '\n'
-    str_temp = date_time + ',ICR temp,' + str(temperature_ICR) + ',ICH temp,' + str(temperature_ICH) + '\n'
+    pressure_rough = gauge.read()
+    str_room = f'{date_time},{pressure_room}'
+    str_cryo = f'{date_time},{pressure_cryo}'
+    str_rough = f'{date_time},{pressure_rough}'
+    str_temp = f'{date_time},ICR temp,{temperature_ICR},ICH temp,{temperature_ICH}'
 
     return str_room, str_cryo, str_rough, str_temp
 
+'''Close the 275 gauge connection and have the reader reopen the Arduino
+port, used after repeated failures.'''
+def reconnect():
+
+    gauge.close()
+    reader.reopen()
+
+'''Log file handler which writes to <path><YYYY-MM-DD><suffix> and moves on
+to the file of the new day at local midnight. Unlike its base class, it does
+not rename the old file, so every day keeps its own dated log file.
+
+The ending is kept in `file_suffix`, since the base class uses `suffix` for
+its own date format. Write errors are raised to the caller instead of only
+being printed, so the main loop can retry.'''
+class DailyFileHandler(logging.handlers.TimedRotatingFileHandler):
+
+    def __init__(self, path, suffix):
+
+        self.path = path
+        self.file_suffix = suffix
+        super().__init__(self._filename(), when='midnight', delay=True)
+
+    def _filename(self):
+
+        return self.path + datetime.now().strftime('%Y-%m-%d') + self.file_suffix
+
+    def handleError(self, record):
+
+        raise
+
+    def doRollover(self):
+
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.baseFilename = os.path.abspath(self._filename())
+        self.rolloverAt = self.computeRollover(time.time())
+
+'''Logger which writes the plain message lines (with their own timestamp) to
+the daily files under `path`.'''
+def make_logger(name, path, suffix):
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = DailyFileHandler(path, suffix)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+
+    return logger
+
+# Check that the handler keeps the file name ending when it rolls over, and
+# that a failed write reaches the caller
+def test_rollover():
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + os.sep
+        logger = make_logger('test_rollover', path, '_chamber.log')
+        handler = logger.handlers[0]
+
+        logger.info('before')
+        handler.rolloverAt = time.time() - 1    # force a rollover on the next record
+        logger.info('after')
+        handler.close()
+        logger.removeHandler(handler)
+
+        expected = datetime.now().strftime('%Y-%m-%d') + '_chamber.log'
+        assert os.listdir(tmp) == [expected], os.listdir(tmp)
+        assert os.path.basename(handler.baseFilename) == expected, handler.baseFilename
+
+        logger = make_logger('test_rollover_error', path + 'missing' + os.sep, '_chamber.log')
+        try:
+            logger.info('lost')
+            raise AssertionError('write to a missing directory did not raise')
+        except OSError:
+            pass
+        finally:
+            logger.handlers[0].close()
+
+    print('Rollover test passed.')
+
+#test_rollover()
+
+'''Read all gauges once and write one line to each log.'''
+def log_once():
+
+    str_room, str_cryo, str_rough, str_temp = get_log_text()
+    room_logger.info(str_room)
+    cryo_logger.info(str_cryo)
+    rough_logger.info(str_rough)
+    temp_logger.info(str_temp)
+
 ########################
 ####      Main      ####
 ########################
@@ -234,37 +395,42 @@ path_room = 'Z:\\Logs\\1041_Chamber_Pressure\\'
 path_cryo = 'Z:\\Logs\\1041_Dewar_Pressure\\'
 path_temp = 'Z:\\Logs\\1041_Chilled_Water\\'
 
-now = datetime.now()
-current_date = now.strftime('%Y-%m-%d')
+max_failures = 5    # consecutive failures before the serial ports are reopened
+period = 60         # time between two log entries, in seconds
 
-while True:
+room_logger = make_logger('room', path_room, '_chamber.log')
+cryo_logger = make_logger('cryo', path_cryo, '_dewar.log')
+rough_logger = make_logger('rough', path_rough, '_foreline.log')
+temp_logger = make_logger('temp', path_temp, '_temperature.log')
 
-    with open(path_room + current_date + '_chamber.log', 'a') as file_room, open(path_cryo + current_date + '_dewar.log', 'a') as file_cryo, open(path_rough + current_date + '_foreline.log', 'a') as file_rough, open(path_temp + current_date + '_temperature.log', 'a') as file_temp:
+# Start draining the Arduino in the background
+reader = SerialReader(ser)
+reader.start()
 
-        while True:
+next_t = time.monotonic()    # deadline of the next log entry
+failures = 0
 
-            now = datetime.now()
-            date = now.strftime('%Y-%m-%d')
-
-            if date == current_date:
-                written = False
-                while not written:
-                    try:
-                        str_room, str_cryo, str_rough, str_temp = get_log_text()
-                        file_room.write(str_room)
-                        file_cryo.write(str_cryo)
-                        file_rough.write(str_rough)
-                        file_temp.write(str_temp)
-                        file_room.flush()
-                        file_cryo.flush()
-                        file_rough.flush()
-                        file_temp.flush()
-                        time.sleep(60)
-                        written = True
-                    except:
-                        print('Other Error Occurred!')
-            else:
-                current_date = date
-                break
+while True:
+
+    try:
+        log_once()
+    except (serial.SerialException, OSError, ValueError, queue.Empty):
+        logging.exception('Other Error Occurred!')
+        failures += 1
+        if failures > max_failures:
+            reconnect()
+            failures = 0
+        time.sleep(1)
+        continue
+    failures = 0
+
+    # Sleep until a fixed deadline, so the time spent on reading does not
+    # add up; skip ahead if behind
+    next_t += period
+    dt = next_t - time.monotonic()
+    if dt > 0:
+        time.sleep(dt)
+    else:
+        next_t = time.monotonic()
 
 ser.close()
@@ -1,2 +1,3 @@
+set PYTHONPATH=C:\Users\Undergrad\Desktop\Logs_Server_Broadcast-master\Logs;%PYTHONPATH%
 pythonw C:\Users\Undergrad\Desktop\Logs_Server_Broadcast-master\Logs\readout_dewar_temperatures.py
 pythonw C:\Users\Undergrad\Desktop\Logs_Server_Broadcast-master\Logs\Pressures_reading\Read_Pressures.py
\ No newline at end of file